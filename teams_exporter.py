@@ -1,8 +1,15 @@
+import functools
 import json
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import hashlib
+import html
 import re
+import queue
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from tqdm import tqdm
 from reportlab.lib.pagesizes import A4
@@ -11,6 +18,11 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
 
+# Precompiled patterns used by clean_html_content (called once per message)
+# Styled tags are tried first so quoted style values containing '>' are removed whole
+_RE_HTML_TAG = re.compile(r'<[^>]*style="[^"]*"[^>]*>|<[^>]+>')
+_RE_WHITESPACE = re.compile(r'\s+')
+
 def get_chat_id_from_user():
     """
     Guides the user to obtain the Chat ID using Graph Explorer with participants info
@@ -105,55 +117,54 @@ def get_token_from_browser():
     
     return token
 
-def extract_participants_from_messages(chat_id, token):
+def create_graph_session(token):
     """
-    Fallback method: extract participant names from messages
+    Creates a shared HTTP session so all Graph API calls reuse the same connection
+    Throttled or unavailable responses (429/503/504) are retried honoring Retry-After
     """
-    headers = {
+    session = requests.Session()
+    session.headers.update({
         'Authorization': token,
         'Content-Type': 'application/json'
-    }
+    })
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False  # Hand the last response back so callers report the HTTP error
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=retry))
+    return session
+
+def extract_participants_from_messages(messages):
+    """
+    Fallback method: extract participant names from already downloaded messages (no API call)
+    """
+    participants = {}  # Keeps first-appearance order
     
-    url = f"https://graph.microsoft.com/v1.0/chats/{chat_id}/messages?$top=50"
+    for message in messages:
+        from_info = message.get('from')
+        user_info = from_info.get('user') if from_info else None
+        if user_info:
+            display_name = user_info.get('displayName', '')
+            if display_name and display_name.strip():
+                participants[display_name] = None
     
-    try:
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            data = response.json()
-            participants = set()
-            
-            if 'value' in data:
-                for message in data['value']:
-                    from_info = message.get('from')
-                    if from_info and 'user' in from_info:
-                        user_info = from_info['user']
-                        display_name = user_info.get('displayName', '')
-                        if display_name and display_name.strip():
-                            participants.add(display_name)
-            
-            if participants:
-                print(f"✅ Extracted {len(participants)} participants from messages")
-                return [{'displayName': name, 'email': 'From messages'} for name in participants]
-            else:
-                print("❌ No participants found in messages")
-                return []
-        else:
-            print(f"❌ Cannot access messages: {response.status_code}")
-            return []
-            
-    except Exception as e:
-        print(f"❌ Error extracting from messages: {str(e)[:50]}...")
+    if participants:
+        print(f"✅ Extracted {len(participants)} participants from messages")
+        return [{'displayName': name, 'email': 'From messages'} for name in participants]
+    else:
+        print("❌ No participants found in messages")
         return []
 
-def get_chat_participants(chat_id, token):
+def get_chat_participants(chat_id, session):
     """
     Get participants information for a specific chat
+    Runs on a worker thread, so status lines are returned for the caller to print
+    Returns: (participants, status_lines)
     """
-    headers = {
-        'Authorization': token,
-        'Content-Type': 'application/json'
-    }
+    status_lines = []
     
     # Try API endpoints for participants (only valid ones)
     approaches = [
@@ -163,7 +174,7 @@ def get_chat_participants(chat_id, token):
     
     for i, url in enumerate(approaches, 1):
         try:
-            response = requests.get(url, headers=headers)
+            response = session.get(url)
             
             if response.status_code == 200:
                 data = response.json()
@@ -190,27 +201,26 @@ def get_chat_participants(chat_id, token):
                             })
                 
                 if participants:
-                    print(f"✅ Retrieved {len(participants)} participants from API")
-                    return participants
+                    status_lines.append(f"✅ Retrieved {len(participants)} participants from API")
+                    return participants, status_lines
                     
             elif response.status_code == 403:
-                print(f"⚠️  Insufficient permissions for participants API")
+                status_lines.append(f"⚠️  Insufficient permissions for participants API")
             elif response.status_code == 401:
-                print(f"❌ Token authentication failed")
+                status_lines.append(f"❌ Token authentication failed")
                 break
                 
         except Exception as e:
-            print(f"⚠️  API error: {str(e)[:50]}...")
+            status_lines.append(f"⚠️  API error: {str(e)[:50]}...")
     
-    # Fallback: extract from messages
-    print("🔄 Extracting participants from messages...")
-    return extract_participants_from_messages(chat_id, token)
+    # Caller falls back to the exported messages (extract_participants_from_messages)
+    return [], status_lines
 
-def create_dual_hashes(response, page_number):
+def create_dual_hashes(response, response_data, page_number):
     """
     Crea hashes duales para diferentes niveles de integridad forense
+    response_data es el JSON ya decodificado de la respuesta (se parsea una sola vez)
     """
-    response_data = response.json()
     messages = response_data.get('value', [])
     
     clean_messages = []
@@ -256,10 +266,37 @@ def create_dual_hashes(response, page_number):
         "messages_count": len(messages)
     }
 
-def export_messages(chat_id, token, output_dir="exported_messages"):
+def write_pages_to_json(file_path, pages_queue, pretty=False):
     """
-    Export: saves all messages in memory and creates final file directly
-    Returns: (file_path, chain_of_custody_data, participants)
+    Background writer: appends each page of messages from the queue to one JSON array
+    A None item marks the end of the export. Output is identical to json.dumps of the full list
+    """
+    indent = 2 if pretty else None
+    separator = ',' if pretty else ', '
+    first_page = True
+    
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        while True:
+            page_messages = pages_queue.get()
+            if page_messages is None:
+                break
+            if not page_messages:
+                continue
+            
+            if not first_page:
+                f.write(separator)
+            # Strip the surrounding brackets (and closing newline when indented) so pages join into one array
+            page_json = json.dumps(page_messages, ensure_ascii=False, indent=indent)
+            f.write(page_json[1:-2] if pretty else page_json[1:-1])
+            first_page = False
+        f.write('\n]' if pretty and not first_page else ']')
+
+def export_messages(chat_id, token, output_dir="exported_messages", pretty=False):
+    """
+    Export: keeps all messages in memory and writes the final file while pages are downloaded
+    The JSON file is written compact unless pretty=True (indented, slower for large chats)
+    Returns: (file_path, chain_of_custody_data, participants, messages)
     """
     
     if not os.path.exists(output_dir):
@@ -270,103 +307,136 @@ def export_messages(chat_id, token, output_dir="exported_messages"):
     print(f"Directory: {output_dir}")
     print("=" * 50)
     
-    headers = {
-        'Authorization': token,
-        'Content-Type': 'application/json'
-    }
+    session = create_graph_session(token)
     
     all_messages = []
     page_hashes = []  # Lista de hashes de cada página
+    master_content_h = hashlib.sha256()   # Master hashes updated page by page
+    master_forensic_h = hashlib.sha256()
     page = 1
     next_link = None
     
-    # Get participants information
-    print("👥 Getting participants information...")
-    participants = get_chat_participants(chat_id, token)
+    # Background workers: participants lookup and JSON writer run while messages are paginated
+    executor = ThreadPoolExecutor(max_workers=2)
     
-    if participants:
-        participant_names = [p['displayName'] for p in participants]
-        print(f"✅ Found {len(participants)} participants: {', '.join(participant_names)}")
-    else:
-        print("⚠️  Could not retrieve participants information")
-        participant_names = ["Unknown Participants"]
-    
-    # Chain of custody metadata - CORREGIDO: usar datetime.now(timezone.utc)
-    export_timestamp = datetime.now(timezone.utc).isoformat()
-    session_metadata = {
-        "chat_id": chat_id,
-        "export_timestamp": export_timestamp,
-        "api_endpoint": f"/chats/{chat_id}/messages",
-        "token_scope": "Chat.Read",
-        "user_agent": "Microsoft Graph API",
-        "export_method": "Microsoft Graph API v1.0"
-    }
+    # Final file is written directly as pages arrive (no temporary files)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    final_file = os.path.join(output_dir, f"complete_conversation_{timestamp}.json")
+    pages_queue = queue.Queue()
+    writer_future = executor.submit(write_pages_to_json, final_file, pages_queue, pretty)
+    export_finished = False
     
-    print("🚀 Starting export...")
-    
-    # Loading indicator with dots
-    import itertools
-    import time
-    dots = itertools.cycle(['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏'])
-    start_time = time.time()
-    
-    while True:
-        if next_link:
-            url = next_link
-        else:
-            url = f"https://graph.microsoft.com/v1.0/chats/{chat_id}/messages?$top=50"
+    try:
+        print("👥 Getting participants information...")
+        participants_future = executor.submit(get_chat_participants, chat_id, session)
         
-        try:
-            response = requests.get(url, headers=headers)
+        # Chain of custody metadata - CORREGIDO: usar datetime.now(timezone.utc)
+        export_timestamp = datetime.now(timezone.utc).isoformat()
+        session_metadata = {
+            "chat_id": chat_id,
+            "export_timestamp": export_timestamp,
+            "api_endpoint": f"/chats/{chat_id}/messages",
+            "token_scope": "Chat.Read",
+            "user_agent": "Microsoft Graph API",
+            "export_method": "Microsoft Graph API v1.0"
+        }
+        
+        print("🚀 Starting export...")
+        
+        # Loading indicator with dots
+        import itertools
+        import time
+        dots = itertools.cycle(['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏'])
+        start_time = time.time()
+        
+        while True:
+            if next_link:
+                url = next_link
+            else:
+                url = f"https://graph.microsoft.com/v1.0/chats/{chat_id}/messages?$top=50"
             
-            if response.status_code == 200:
-                # Crear hashes duales para esta página
-                dual_hashes = create_dual_hashes(response, page)
-                
-                # Guardar hash de esta página con sistema dual
-                page_hash = {
-                    "page": page,
-                    "url": url,
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "status_code": response.status_code,
-                    "content_hash": dual_hashes["content_hash"],      # Hash determinístico
-                    "forensic_hash": dual_hashes["forensic_hash"],    # Hash forense completo
-                    "messages_count": dual_hashes["messages_count"]
-                }
-                page_hashes.append(page_hash)
-                
-                data = response.json()
+            try:
+                response = session.get(url)
                 
-                if 'value' in data:
-                    messages_in_page = len(data['value'])
-                    all_messages.extend(data['value'])
+                if response.status_code == 200:
+                    # Decode the raw bytes once; hashes and export share the parsed page
+                    data = json.loads(response.content)
                     
-                    # Show loading with time-based spinner update
-                    elapsed = time.time() - start_time
-                    spinner_char = next(dots)
-                    print(f"\r📄 Exporting {spinner_char} Page {page} - {len(all_messages)} messages ({elapsed:.1f}s)", end="", flush=True)
-                
-                # Check if there are more pages
-                next_link = data.get('@odata.nextLink')
-                
-                if next_link:
-                    page += 1
-                    time.sleep(1)  # Pause to avoid API overload
+                    # Crear hashes duales para esta página
+                    dual_hashes = create_dual_hashes(response, data, page)
+                    
+                    # Guardar hash de esta página con sistema dual
+                    page_hash = {
+                        "page": page,
+                        "url": url,
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "status_code": response.status_code,
+                        "content_hash": dual_hashes["content_hash"],      # Hash determinístico
+                        "forensic_hash": dual_hashes["forensic_hash"],    # Hash forense completo
+                        "messages_count": dual_hashes["messages_count"]
+                    }
+                    page_hashes.append(page_hash)
+                    master_content_h.update(page_hash["content_hash"].encode())
+                    master_forensic_h.update(page_hash["forensic_hash"].encode())
+                    
+                    if 'value' in data:
+                        messages_in_page = len(data['value'])
+                        all_messages.extend(data['value'])
+                        pages_queue.put(data['value'])
+                        
+                        # Show loading with time-based spinner update
+                        elapsed = time.time() - start_time
+                        spinner_char = next(dots)
+                        print(f"\r📄 Exporting {spinner_char} Page {page} - {len(all_messages)} messages ({elapsed:.1f}s)", end="", flush=True)
+                    
+                    # Check if there are more pages
+                    next_link = data.get('@odata.nextLink')
+                    
+                    if next_link:
+                        page += 1
+                    else:
+                        print(f"\n🎉 Export completed! Total: {len(all_messages)} messages")
+                        break
+                        
+                elif response.status_code == 401:
+                    print("\n❌ Error: Token expired or invalid")
+                    print("You need to get a new token from Graph Explorer")
+                    break
                 else:
-                    print(f"\n🎉 Export completed! Total: {len(all_messages)} messages")
+                    print(f"\n❌ HTTP Error {response.status_code}: {response.text}")
                     break
                     
-            elif response.status_code == 401:
-                print("\n❌ Error: Token expired or invalid")
-                print("You need to get a new token from Graph Explorer")
-                break
-            else:
-                print(f"\n❌ HTTP Error {response.status_code}: {response.text}")
+            except Exception as e:
+                print(f"\n❌ Request error: {e}")
                 break
-                
-        except Exception as e:
-            print(f"\n❌ Request error: {e}")
-            break
+        
+        export_finished = True
+    finally:
+        # Always release the writer (also on Ctrl+C) so its worker thread can exit
+        pages_queue.put(None)
+        executor.shutdown(wait=False)
+        if not export_finished:
+            # Aborted export: let the writer close the file, then drop the incomplete JSON
+            writer_future.exception()
+            if os.path.exists(final_file):
+                os.remove(final_file)
+    
+    # Participant lookup status is printed here so it does not interleave with the spinner
+    participants, participants_status = participants_future.result()
+    for status_line in participants_status:
+        print(status_line)
+    
+    if not participants and all_messages:
+        # Fallback: reuse the pages already downloaded instead of fetching messages again
+        print("🔄 Extracting participants from messages...")
+        participants = extract_participants_from_messages(all_messages)
+    
+    if participants:
+        participant_names = [p['displayName'] for p in participants]
+        print(f"✅ Found {len(participants)} participants: {', '.join(participant_names)}")
+    else:
+        print("⚠️  Could not retrieve participants information")
+        participant_names = ["Unknown Participants"]
     
     # Create chain of custody data - CORREGIDO: usar datetime.now(timezone.utc) y eliminar datos sensibles
     chain_of_custody = {
@@ -381,25 +451,19 @@ def export_messages(chat_id, token, output_dir="exported_messages"):
         }
     }
     
-    # Calculate master hash from all content hashes (deterministic)
-    all_content_hashes_combined = "".join([ph["content_hash"] for ph in page_hashes])
-    chain_of_custody["peritaje_info"]["master_content_hash"] = hashlib.sha256(all_content_hashes_combined.encode()).hexdigest()
+    # Master hash from all content hashes (deterministic), accumulated during pagination
+    chain_of_custody["peritaje_info"]["master_content_hash"] = master_content_h.hexdigest()
     
-    # Calculate forensic master hash from all forensic hashes (complete integrity)
-    all_forensic_hashes_combined = "".join([ph["forensic_hash"] for ph in page_hashes])
-    chain_of_custody["peritaje_info"]["master_forensic_hash"] = hashlib.sha256(all_forensic_hashes_combined.encode()).hexdigest()
+    # Forensic master hash from all forensic hashes (complete integrity)
+    chain_of_custody["peritaje_info"]["master_forensic_hash"] = master_forensic_h.hexdigest()
+    
+    # Wait for the writer to flush the remaining pages
+    print(f"\n💾 Saving file...")
+    with tqdm(total=1, desc="💾 Saving", unit="file") as pbar:
+        writer_future.result()
+        pbar.update(1)
     
-    # Save final file directly (no temporary files)
     if all_messages:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        final_file = os.path.join(output_dir, f"complete_conversation_{timestamp}.json")
-        
-        print(f"\n💾 Saving file...")
-        with tqdm(total=1, desc="💾 Saving", unit="file") as pbar:
-            with open(final_file, 'w', encoding='utf-8') as f:
-                json.dump(all_messages, f, ensure_ascii=False, indent=2)
-            pbar.update(1)
-        
         print(f"\n🎉 EXPORT COMPLETED")
         print(f"📁 Final file: {final_file}")
         print(f"📊 Total messages: {len(all_messages)}")
@@ -412,10 +476,11 @@ def export_messages(chat_id, token, output_dir="exported_messages"):
         print(f"📅 First message: {first_msg.get('createdDateTime', 'N/A')}")
         print(f"📅 Last message: {last_msg.get('createdDateTime', 'N/A')}")
         
-        return final_file, chain_of_custody, participant_names
+        return final_file, chain_of_custody, participant_names, all_messages
     else:
+        os.remove(final_file)
         print("❌ No messages retrieved")
-        return None, None, None
+        return None, None, None, None
 
 def clean_html_content(html_content):
     """
@@ -424,35 +489,40 @@ def clean_html_content(html_content):
     if not html_content:
         return ""
     
-    # Remove complex HTML tags and keep only text
-    # Remove tags with styles
-    content = re.sub(r'<[^>]*style="[^"]*"[^>]*>', '', html_content)
+    # Remove HTML tags (including tags with styles) but keep text
+    content = _RE_HTML_TAG.sub('', html_content)
     
-    # Remove HTML tags but keep text
-    content = re.sub(r'<[^>]+>', '', content)
+    # Decode HTML entities (&nbsp;, &amp;, &lt;, &gt;, &quot;, ...) in a single pass
+    content = html.unescape(content)
     
-    # Decode common HTML entities
-    content = content.replace('&nbsp;', ' ')
-    content = content.replace('&amp;', '&')
-    content = content.replace('&lt;', '<')
-    content = content.replace('&gt;', '>')
-    content = content.replace('&quot;', '"')
-    
-    # Clean extra spaces
-    content = re.sub(r'\s+', ' ', content).strip()
+    # Clean extra spaces (also folds the non-breaking spaces left by &nbsp;)
+    content = _RE_WHITESPACE.sub(' ', content).strip()
     
     return content
 
+def format_message_date(created_date):
+    """
+    Formats a Graph ISO timestamp as DD/MM/YYYY HH:MM:SS without building a datetime
+    Graph timestamps have a fixed layout (2024-01-31T09:15:42.123Z), so fields are sliced
+    """
+    if (not created_date or len(created_date) < 19 or created_date[4] != '-'
+            or created_date[10] != 'T' or created_date[13] != ':'):
+        return created_date
+    return (f"{created_date[8:10]}/{created_date[5:7]}/{created_date[0:4]} "
+            f"{created_date[11:13]}:{created_date[14:16]}:{created_date[17:19]}")
+
+@functools.lru_cache(maxsize=1)
 def load_language_config():
     """
     Loads language configuration from JSON file
+    The file is read once per process; the result is read-only since it is shared
     """
     try:
         with open('language_config.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
+            return MappingProxyType(json.load(f))
     except FileNotFoundError:
         print("❌ language_config.json not found. Using default English.")
-        return {
+        return MappingProxyType({
             "en": {
                 "document_title": "MICROSOFT TEAMS CONVERSATION",
                 "document_subtitle": "Official certified export",
@@ -475,7 +545,27 @@ def load_language_config():
                 "certification_date": "Certification date:",
                 "final_certificate_text": "This document is a faithful conversion of the original data. The chain of custody provides cryptographic proof of data integrity and authenticity."
             }
-        }
+        })
+
+def select_json_format():
+    """
+    JSON format selection: compact (default, fastest) or indented for manual review
+    """
+    print("🗂️  SELECT JSON FORMAT")
+    print("-" * 25)
+    print("1. Compact (default, faster and smaller for large chats)")
+    print("2. Indented (easier to read for manual review)")
+    print()
+    
+    while True:
+        choice = input("Enter format number (default: 1): ").strip()
+        
+        if not choice or choice == "1":
+            return False
+        elif choice == "2":
+            return True
+        
+        print("❌ Invalid choice. Please enter 1 or 2")
 
 def select_language():
     """
@@ -512,9 +602,10 @@ def select_language():
         
         print("❌ Invalid choice. Please enter 1-4 or en/es/fr/de")
 
-def convert_json_to_pdf(json_file, chain_of_custody, participant_names, language="en", output_file=None):
+def convert_json_to_pdf(json_file, chain_of_custody, participant_names, language="en", output_file=None, messages=None):
     """
     Converts Teams JSON to PDF with real chain of custody certificate
+    If messages is provided (already in memory after export), json_file is not re-read
     """
     print(f"\n📄 Converting {json_file} to PDF in {language}...")
     
@@ -532,8 +623,11 @@ def convert_json_to_pdf(json_file, chain_of_custody, participant_names, language
     lang_config = load_language_config()
     texts = lang_config.get(language, lang_config["en"])  # Default to English
     
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    if messages is not None:
+        data = messages
+    else:
+        with open(json_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
     
     # Create PDF document
     doc = SimpleDocTemplate(output_file, pagesize=A4)
@@ -549,15 +643,22 @@ def convert_json_to_pdf(json_file, chain_of_custody, participant_names, language
         alignment=1  # Centered
     )
     
-    # Style for messages
+    # Style for messages (spaceAfter includes the gap between messages, no extra Spacer needed)
     message_style = ParagraphStyle(
         'MessageStyle',
         parent=styles['Normal'],
         fontSize=10,
-        spaceAfter=12,
+        spaceAfter=22,
         leftIndent=20
     )
     
+    # Style for the separator line added every 10 messages
+    separator_style = ParagraphStyle(
+        'SeparatorStyle',
+        parent=styles['Normal'],
+        spaceAfter=10
+    )
+    
     # Style for hash and metadata (smaller font)
     metadata_style = ParagraphStyle(
         'MetadataStyle',
@@ -665,6 +766,19 @@ def convert_json_to_pdf(json_file, chain_of_custody, participant_names, language
     total_messages = len(data)
     print(f"📝 Processing {total_messages} messages...")
     
+    # Message markup is built once; only the per-message values are filled in the loop
+    message_template = (
+        f"<b>{texts['message']} {{index}}</b> - {{date}}<br/>"
+        f"<b>{texts['from']}</b> {{user}}<br/>"
+        f"<b>{texts['content']}</b><br/>{{content}}"
+    )
+    
+    # Bind loop invariants to locals to avoid repeated lookups per message
+    format_message = message_template.format
+    unidentified_user = texts["unidentified_user"]
+    unknown_user = texts["unknown_user"]
+    add_to_story = story.append
+    
     # Create progress bar for message processing
     with tqdm(total=total_messages, desc="📝 Processing", unit="msg") as pbar:
         for i, message in enumerate(data, 1):
@@ -674,36 +788,30 @@ def convert_json_to_pdf(json_file, chain_of_custody, participant_names, language
             # Handle cases where 'from' is None
             from_info = message.get('from')
             if from_info is None:
-                from_user = texts["unidentified_user"]
+                from_user = unidentified_user
             else:
-                user_info = from_info.get('user', {})
-                from_user = user_info.get('displayName', texts["unknown_user"])
+                user_info = from_info.get('user')
+                from_user = user_info.get('displayName', unknown_user) if user_info else unknown_user
             
-            body_info = message.get('body', {})
+            body_info = message.get('body')
             body_content = body_info.get('content', '') if body_info else ''
             
             # Clean HTML content
             clean_content = clean_html_content(body_content)
             
             # Convert date
-            try:
-                dt = datetime.fromisoformat(created_date.replace('Z', '+00:00'))
-                formatted_date = dt.strftime('%d/%m/%Y %H:%M:%S')
-            except:
-                formatted_date = created_date
+            formatted_date = format_message_date(created_date)
             
             # Create message in PDF (without HTML)
-            message_text = f"<b>{texts['message']} {i}</b> - {formatted_date}<br/>"
-            message_text += f"<b>{texts['from']}</b> {from_user}<br/>"
-            message_text += f"<b>{texts['content']}</b><br/>{clean_content}"
+            message_text = format_message(
+                index=i, date=formatted_date, user=from_user, content=clean_content
+            )
             
-            story.append(Paragraph(message_text, message_style))
-            story.append(Spacer(1, 10))
+            add_to_story(Paragraph(message_text, message_style))
             
             # Add separator line every 10 messages
             if i % 10 == 0:
-                story.append(Paragraph("_" * 80, styles['Normal']))
-                story.append(Spacer(1, 10))
+                add_to_story(Paragraph("_" * 80, separator_style))
             
             # Update progress bar
             pbar.update(1)
@@ -748,10 +856,14 @@ def main():
         print("❌ No valid token provided")
         return
     
+    # JSON is written while pages download, so the format is chosen before exporting
+    print()
+    pretty_json = select_json_format()
+    
     # Step 1: Export messages
     print(f"\n📤 STEP 1: EXPORTING MESSAGES")
     print("-" * 40)
-    result_file, chain_of_custody, participant_names = export_messages(chat_id, token, OUTPUT_DIR)
+    result_file, chain_of_custody, participant_names, messages = export_messages(chat_id, token, OUTPUT_DIR, pretty_json)
     
     if not result_file:
         print("❌ Message export failed")
@@ -765,7 +877,7 @@ def main():
     # Step 3: Convert to PDF
     print(f"\n📄 STEP 3: CONVERTING TO PDF")
     print("-" * 30)
-    pdf_file = convert_json_to_pdf(result_file, chain_of_custody, participant_names, language, None)
+    pdf_file = convert_json_to_pdf(result_file, chain_of_custody, participant_names, language, None, messages)
     
     if not pdf_file:
         print("❌ PDF conversion failed")
@@ -777,7 +889,7 @@ def main():
     print(f"📁 JSON file: {result_file}")
     print(f"📄 PDF file: {pdf_file}")
     print(f"🌍 Language: {language}")
-    print(f"📊 Total messages: {len(json.load(open(result_file, 'r', encoding='utf-8')))}")
+    print(f"📊 Total messages: {len(messages)}")
     print(f"📄 Total pages: {chain_of_custody['peritaje_info']['total_pages'] if chain_of_custody else 'N/A'}")
     print(f"🔒 Master Content Hash (deterministic): {chain_of_custody['peritaje_info'].get('master_content_hash', 'N/A') if chain_of_custody else 'N/A'}")
     print(f"🔒 Master Forensic Hash (complete): {chain_of_custody['peritaje_info'].get('master_forensic_hash', 'N/A') if chain_of_custody else 'N/A'}")